@@ -8,24 +8,25 @@ from dotenv import load_dotenv
 
 from livekit import agents, api
 from livekit.agents import AgentSession, Agent, RoomInputOptions
-from livekit.plugins import (
-    openai,
-    cartesia,
-    deepgram,
-    elevenlabs,
-    # noise_cancellation,
-    silero,
-    groq,
-)
-from livekit.plugins.turn_detector.multilingual import MultilingualModel
 from livekit.agents import metrics, MetricsCollectedEvent
 import logging
 
 from datetime import datetime, timedelta
 import asyncio
+import dataclasses
 from typing import Union, Annotated, Any, Dict, List, get_type_hints, get_origin, get_args
 from dataclasses import dataclass
 
+from pipeline import build_llm, build_session_options, load_vad, pipeline_override, prewarm, redact_config, resolve_pipeline_config
+from chat_history import ChatHistoryManager
+from tts_scheduling import AdaptiveChunkScheduler
+from endpointing import EndpointingController
+from metrics_utils import distribution_summary
+from teardown import CallTeardown
+from spool import CallSpool, replay_pending_spools
+from profiling import JobProfiler, PROFILING_ENABLED
+from worker_load import JobStatsReporter, LOAD_THRESHOLD, load_fnc, request_fnc, stats_dir
+
 logger = logging.getLogger("my-worker")
 logger.setLevel(logging.INFO)
 
@@ -33,6 +34,8 @@ load_dotenv()
 
 backend_url = os.getenv("BACKEND_URL")
 
+# milliseconds of caller silence before the agent may take the turn, used as the
+# baseline minimum endpointing delay
 silence_detection_threshold = int(os.getenv("SILENCE_DETECTION_THRESHOLD"))
 print(f"silence_detection_threshold: {silence_detection_threshold}")
 
@@ -171,10 +174,121 @@ def create_dynamic_tool_function(tool_config: Dict[str, Any], user_id: str):
     return dynamic_func
 
 
+def build_call_pipeline(pipeline_config: Dict[str, Any], endpointing_baseline: float):
+    """Builds the AgentSession and the per-call controllers from a resolved pipeline config.
+
+    Raises on an invalid config (unknown provider, constructor kwarg or turn option).
+    """
+    endpointing_controller = None
+    if pipeline_config["adaptive_endpointing"].get("enabled"):
+        endpointing_controller = EndpointingController.from_config(
+            endpointing_baseline,
+            pipeline_config["adaptive_endpointing"],
+            max_delay=pipeline_config["turn"]["max_endpointing_delay"],
+            vad=load_vad(),
+        )
+        pipeline_config["turn"]["min_endpointing_delay"] = endpointing_controller.min_delay
+
+    history_manager = None
+    if pipeline_config["history"].get("enabled"):
+        # separate LLM instance so summary requests stay out of the session's LLM metrics
+        history_manager = ChatHistoryManager(
+            build_llm(pipeline_config["history"]["summary_llm"]),
+            keep_turns=pipeline_config["history"]["keep_turns"],
+            summarize_every=pipeline_config["history"]["summarize_every"],
+        )
+
+    tts_scheduler = None
+    if pipeline_config["adaptive_tts"].get("enabled"):
+        tts_scheduler = AdaptiveChunkScheduler.from_config(
+            pipeline_config["adaptive_tts"],
+            initial_schedule=pipeline_config["tts"].get("chunk_length_schedule"),
+        )
+
+    session_options = build_session_options(pipeline_config)
+    session = AgentSession(**session_options)
+    return session, session_options, endpointing_controller, history_manager, tts_scheduler
+
+
 async def entrypoint(ctx: agents.JobContext):
     
+    # opt-in loop stall / CPU / memory profiling, see profiling.py
+    profiler = None
+    if PROFILING_ENABLED:
+        profiler = JobProfiler(ctx.job.id)
+        profiler.start()
     
     httpclient = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_keepalive_connections=5, max_connections=10))
+    lkapi = api.LiveKitAPI()
+
+    # Initialize cumulative metrics dictionary
+    cumulative_metrics = {
+        "llm_prompt_tokens": 0,
+        "llm_completion_tokens": 0,
+        # "stt_duration": 0.0,
+        "stt_audio_duration": 0.0,
+        "tts_characters_count": 0,
+        # "tts_duration": [],  
+        "tts_audio_duration": 0.0,
+        "end_of_utterance_delay": [],
+        "transcription_delay": [],
+        "llm_ttft": [],
+        "tts_ttfb": [],
+        # "vad_inference_count": [],
+        # "vad_inference_duration_total": [],
+        "end_of_utterance_delay_avg": 0,
+        "transcription_delay_avg": 0,
+        "llm_ttft_avg": 0,
+        "tts_ttfb_avg": 0
+    }
+    
+    usage_collector = metrics.UsageCollector()
+
+    # filled in as the call is set up; the shutdown callback skips whatever is still None
+    call_spool = None
+    replay_task = None
+    job_stats = None
+    endpointing_controller = None
+    history_manager = None
+    tts_scheduler = None
+    teardown = CallTeardown()
+
+    async def log_usage():
+        summary = usage_collector.get_summary()
+        logger.info(f"Usage: {summary}")
+        if call_spool:
+            call_spool.record("usage", dataclasses.asdict(summary))
+            # bounded, anything unsent is replayed by a later job
+            await call_spool.aclose()
+        if replay_task and not replay_task.done():
+            # acks are written per batch, the next job resumes where this one stopped
+            replay_task.cancel()
+            try:
+                await replay_task
+            except asyncio.CancelledError:
+                pass
+        if endpointing_controller:
+            cumulative_metrics["turn_gap_distribution"] = distribution_summary(endpointing_controller.turn_gaps)
+            logger.info(f"Endpointing: {endpointing_controller.summary()}")
+        logger.info(f"Cumulative Metrics: {cumulative_metrics}")
+        if tts_scheduler:
+            logger.info(f"Final TTS chunk_length_schedule: {tts_scheduler.schedule}")
+        if job_stats:
+            await job_stats.aclose()
+        if history_manager:
+            await history_manager.aclose()
+            logger.info(f"Prompt size / TTFT trend: {history_manager.trend_report()}")
+        if profiler:
+            # before the clients are closed so the report shows what the call left open
+            await profiler.aclose(clients={"httpclient": httpclient, "lkapi": lkapi})
+        await httpclient.aclose()
+        await lkapi.aclose()
+        if teardown.started:
+            logger.info(f"Hangup teardown: {teardown.report()}")
+
+    # registered before any await: a hangup can shut the job down during setup,
+    # and only the callbacks registered by then are run
+    ctx.add_shutdown_callback(log_usage)
 
     # Define participant event handlers *before* potentially missing the event
     call_start_time = ""
@@ -184,10 +298,16 @@ async def entrypoint(ctx: agents.JobContext):
         call_start_time = datetime.now()
         logger.info(f"participant connected at: {call_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
+    # filled in as the call is set up, read by the hangup teardown
+    session = None
+    egress_id = None
+
     def on_participant_left(participant):
         nonlocal call_end_time
         call_end_time = datetime.now()
         logger.info(f"participant {participant.identity} left at: {call_end_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        # free the job slot instead of letting generation and recording run on
+        teardown.start(ctx, session, lkapi, egress_id)
     # Register event handlers *immediately* after connecting
     ctx.room.on("participant_connected", on_participant_connected)
     ctx.room.on("participant_disconnected", on_participant_left)
@@ -215,7 +335,18 @@ async def entrypoint(ctx: agents.JobContext):
     except Exception as e:
         logger.error(f"Failed to send acknowledgement: {str(e)}")
 
+    # stream turns, tool results and usage to the backend through a local spool file
+    if backend_url:
+        try:
+            call_spool = CallSpool(call_id, backend_url, httpclient)
+            call_spool.start()
+        except Exception as e:
+            logger.error(f"Failed to open call spool: {str(e)}")
+        # send whatever crashed jobs left behind, in the background
+        replay_task = asyncio.create_task(replay_pending_spools(backend_url, httpclient), name="spool_replay")
+
     #get the agent config details from the datastore by using the agent_id
+    agent_config = {}
     try:
         # Create a single client for all requests in this function            
         if not backend_url:
@@ -296,6 +427,12 @@ async def entrypoint(ctx: agents.JobContext):
                 def __init__(self) -> None:
                     super().__init__(instructions=final_system_prompt)
 
+                def llm_node(self, chat_ctx, tools, model_settings):
+                    # send the system prompt, rolling summary and recent turns instead of the full history
+                    if history_manager:
+                        chat_ctx = history_manager.window(chat_ctx)
+                    return Agent.default.llm_node(self, chat_ctx, tools, model_settings)
+
             
             # add the transcript of the previous calls
             # Safely access previous_calls with a default empty list
@@ -335,6 +472,11 @@ async def entrypoint(ctx: agents.JobContext):
     except Exception as e:
         logger.error(f"Unexpected error fetching user record: {str(e)}")
     
+    if teardown.started:
+        # the caller hung up during setup, do not start a recording or a session for nobody
+        logger.info("Participant left during call setup, skipping recording and session")
+        return
+
     # Generate a unique filename with timestamp and participant identity 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     # s3_unique_filename = f"{ctx.room.name}_{sid}_{timestamp}"
@@ -357,11 +499,11 @@ async def entrypoint(ctx: agents.JobContext):
         )],
     )
     
-    lkapi = api.LiveKitAPI()
     s3_url = ""
     try:
         res = await lkapi.egress.start_room_composite_egress(req)
         logger.info(f"Started room recording: {res.egress_id}")
+        egress_id = res.egress_id
         
         bucket_name = os.getenv("AWS_S3_BUCKET")
         region = os.getenv("AWS_REGION", "ap-south-1")
@@ -377,20 +519,47 @@ async def entrypoint(ctx: agents.JobContext):
     
     
     await ctx.connect()
-    session = AgentSession(
-        stt=deepgram.STT(model="nova-2-general", language="hi"),
-        llm=openai.LLM(model="gpt-4o-mini"),
-        # llm=groq.LLM(
-        #     model="llama-3.1-8b-instant"
-        # ),
-        tts=elevenlabs.TTS(
-            voice_id="NeDTo4pprKj2ZwuNJceH",
-            model="eleven_flash_v2_5",
-            chunk_length_schedule=[50, 100, 200, 260],
-        ),
-        vad=silero.VAD.load(),
-        turn_detection=MultilingualModel(),
-    )
+    # STT/LLM/TTS and their latency knobs come from the agent_config "pipeline" section
+    pipeline_config = resolve_pipeline_config(agent_config)
+    logger.info(f"pipeline_config: {redact_config(pipeline_config)}")
+    # a per-agent turn.min_endpointing_delay wins over the worker-wide threshold
+    endpointing_baseline = pipeline_override(agent_config, "turn", "min_endpointing_delay")
+    if endpointing_baseline is None:
+        endpointing_baseline = silence_detection_threshold / 1000
+    try:
+        session, session_options, endpointing_controller, history_manager, tts_scheduler = build_call_pipeline(
+            pipeline_config, endpointing_baseline
+        )
+    except Exception as e:
+        # a bad pipeline section must not leave the caller in silence
+        logger.error(f"Invalid pipeline config, falling back to the defaults: {str(e)}")
+        pipeline_config = resolve_pipeline_config({})
+        session, session_options, endpointing_controller, history_manager, tts_scheduler = build_call_pipeline(
+            pipeline_config, silence_detection_threshold / 1000
+        )
+
+    if call_spool:
+        @session.on("conversation_item_added")
+        def _on_conversation_item_added(ev):
+            call_spool.record("turn", {
+                "role": ev.item.role,
+                "text": ev.item.text_content,
+                "interrupted": ev.item.interrupted,
+            })
+
+        @session.on("function_tools_executed")
+        def _on_function_tools_executed(ev):
+            for call, output in ev.zipped():
+                call_spool.record("tool", {
+                    "name": call.name,
+                    "arguments": call.arguments,
+                    "output": output.output,
+                    "is_error": output.is_error,
+                })
+
+    if teardown.started:
+        logger.info("Participant left during call setup, skipping session start")
+        return
 
     await session.start(
         room=ctx.room,
@@ -403,29 +572,22 @@ async def entrypoint(ctx: agents.JobContext):
     await session.generate_reply(
         instructions="Greet the user and offer your assistance."
     )
-    
-    # Initialize cumulative metrics dictionary
-    cumulative_metrics = {
-        "llm_prompt_tokens": 0,
-        "llm_completion_tokens": 0,
-        # "stt_duration": 0.0,
-        "stt_audio_duration": 0.0,
-        "tts_characters_count": 0,
-        # "tts_duration": [],  
-        "tts_audio_duration": 0.0,
-        "end_of_utterance_delay": [],
-        "transcription_delay": [],
-        "llm_ttft": [],
-        "tts_ttfb": [],
-        # "vad_inference_count": [],
-        # "vad_inference_duration_total": [],
-        "end_of_utterance_delay_avg": 0,
-        "transcription_delay_avg": 0,
-        "llm_ttft_avg": 0,
-        "tts_ttfb_avg": 0
-    }
-    
-    usage_collector = metrics.UsageCollector()
+
+    # publishes this job's loop lag and turn processing delays for the worker load function
+    job_stats = JobStatsReporter(ctx.job.id)
+    job_stats.start()
+
+    if endpointing_controller:
+        cumulative_metrics["turn_gap"] = endpointing_controller.turn_gaps
+
+        @session.on("user_state_changed")
+        def _on_user_state_changed(ev):
+            endpointing_controller.on_user_state_changed(ev.new_state)
+            endpointing_controller.apply(session)
+
+        @session.on("agent_state_changed")
+        def _on_agent_state_changed(ev):
+            endpointing_controller.on_agent_state_changed(ev.new_state)
     
     @session.on("metrics_collected")
     def _on_metrics_collected(agent_metrics: MetricsCollectedEvent):
@@ -434,6 +596,9 @@ async def entrypoint(ctx: agents.JobContext):
 
         # Access the actual metrics object
         metric_data = agent_metrics.metrics
+        usage_collector.collect(metric_data)
+        if call_spool and not isinstance(metric_data, metrics.VADMetrics):
+            call_spool.record("metrics", metric_data.model_dump())
 
         # Check the type of the metrics data and update cumulative values
         # if isinstance(metric_data, metrics.PipelineVADMetrics):
@@ -442,10 +607,20 @@ async def entrypoint(ctx: agents.JobContext):
         if isinstance(metric_data, metrics.EOUMetrics):
             cumulative_metrics["end_of_utterance_delay"].append(metric_data.end_of_utterance_delay)
             cumulative_metrics["transcription_delay"].append(metric_data.transcription_delay)
+            job_stats.observe_eou(metric_data.transcription_delay, metric_data.on_user_turn_completed_delay)
+            if endpointing_controller:
+                endpointing_controller.observe_eou(metric_data.end_of_utterance_delay)
+                endpointing_controller.apply(session)
         elif isinstance(metric_data, metrics.LLMMetrics):
             cumulative_metrics["llm_ttft"].append(metric_data.ttft)
             cumulative_metrics["llm_prompt_tokens"] += metric_data.prompt_tokens
             cumulative_metrics["llm_completion_tokens"] += metric_data.completion_tokens
+            teardown.observe_llm(metric_data.completion_tokens, metric_data.cancelled)
+            if history_manager:
+                history_manager.record_llm_metrics(metric_data.prompt_tokens, metric_data.ttft)
+            if tts_scheduler:
+                tts_scheduler.observe_llm(metric_data.ttft, metric_data.tokens_per_second, metric_data.completion_tokens)
+                tts_scheduler.apply(session_options["tts"])
             # logger.info(f"LLM Metrics collected: prompt={metric_data.prompt_tokens}, completion={metric_data.completion_tokens}")
         elif isinstance(metric_data, metrics.STTMetrics):
             # cumulative_metrics["stt_duration"] += metric_data.duration
@@ -456,13 +631,17 @@ async def entrypoint(ctx: agents.JobContext):
             cumulative_metrics["tts_characters_count"] += metric_data.characters_count
             # cumulative_metrics["tts_duration"].append(metric_data.duration)
             cumulative_metrics["tts_audio_duration"] += metric_data.audio_duration
-        
-    async def log_usage():
-        summary = usage_collector.get_summary()
-        logger.info(f"Usage: {summary}")
-        logger.info(f"Cumulative Metrics: {cumulative_metrics}")
-        
-    ctx.add_shutdown_callback(log_usage)
+            if tts_scheduler:
+                tts_scheduler.observe_tts(metric_data.ttfb)
+                tts_scheduler.apply(session_options["tts"])
 
 if __name__ == "__main__":
-    agents.cli.run_app(agents.WorkerOptions(entrypoint_fnc=entrypoint))
\ No newline at end of file
+    # create the job stats directory before job processes are spawned so they inherit it
+    stats_dir()
+    agents.cli.run_app(agents.WorkerOptions(
+        entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm,
+        request_fnc=request_fnc,
+        load_fnc=load_fnc,
+        load_threshold=LOAD_THRESHOLD,
+    ))
\ No newline at end of file
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from livekit.agents import llm
+
+from metrics_utils import distribution_summary
+
+logger = logging.getLogger("my-worker")
+
+SUMMARY_PREFIX = "Summary of the earlier part of this call:\n"
+
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a phone call between an agent and a customer.
+Update the existing summary with the new conversation lines below. Keep every fact the agent
+may need later: names, numbers, amounts, dates, commitments, objections, what the customer agreed
+or refused, and any tool results. Write compact plain text, no more than 200 words."""
+
+
+def _item_text(item) -> Optional[str]:
+    if item.type == "message":
+        text = item.text_content
+        return f"{item.role}: {text}" if text else None
+    if item.type == "function_call":
+        return f"tool call {item.name}({item.arguments})"
+    if item.type == "function_call_output":
+        return f"tool result {item.name}: {item.output}"
+    return None
+
+
+def _linear_slope(values: List[float]) -> float:
+    """Least-squares slope of values against their index, i.e. growth per turn."""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    denominator = sum((x - mean_x) ** 2 for x in range(n))
+    return numerator / denominator
+
+
+class ChatHistoryManager:
+    """Keeps the LLM prompt bounded on long calls.
+
+    The prompt sent to the LLM is the system instructions, a rolling summary of
+    older turns and the last `keep_turns` turns verbatim. The summary is refreshed
+    by a background task on its own LLM instance, so the response path never waits
+    for it; turns that the summary does not cover yet are kept verbatim.
+    The agent's own chat_ctx is left untouched, only the LLM input is windowed.
+    """
+
+    def __init__(self, summary_llm, keep_turns: int = 6, summarize_every: int = 4) -> None:
+        self.summary_llm = summary_llm
+        self.keep_turns = keep_turns
+        self.summarize_every = summarize_every
+
+        self.summary = ""
+        # id of the last chat item folded into the summary
+        self._summarized_upto: Optional[str] = None
+        self._summary_task: Optional[asyncio.Task] = None
+        self._windowed = False
+        self.turns: List[Dict[str, Any]] = []
+
+    def window(self, chat_ctx: llm.ChatContext) -> llm.ChatContext:
+        """Returns the chat context to send to the LLM and schedules a summary refresh if due."""
+        items = chat_ctx.items
+        system_items = [item for item in items if item.type == "message" and item.role in ("system", "developer")]
+        history = [item for item in items if not (item.type == "message" and item.role in ("system", "developer"))]
+
+        user_indexes = [i for i, item in enumerate(history) if item.type == "message" and item.role == "user"]
+        if len(user_indexes) <= self.keep_turns:
+            self._windowed = False
+            return chat_ctx
+        cutoff = user_indexes[-self.keep_turns]
+
+        self._maybe_refresh_summary(history[:cutoff])
+
+        # never drop turns the summary does not cover yet
+        summarized = 0
+        if self._summarized_upto is not None:
+            summarized = next(
+                (i + 1 for i, item in enumerate(history) if item.id == self._summarized_upto), 0
+            )
+        start = min(cutoff, summarized)
+        if start == 0:
+            self._windowed = False
+            return chat_ctx
+
+        windowed = llm.ChatContext(list(system_items))
+        windowed.add_message(role="system", content=SUMMARY_PREFIX + self.summary)
+        windowed.items.extend(history[start:])
+        self._windowed = True
+        return windowed
+
+    def _maybe_refresh_summary(self, older_items: List[Any]) -> None:
+        if self._summary_task is not None and not self._summary_task.done():
+            return
+        start = 0
+        if self._summarized_upto is not None:
+            start = next((i + 1 for i, item in enumerate(older_items) if item.id == self._summarized_upto), 0)
+        pending = older_items[start:]
+        pending_turns = sum(1 for item in pending if item.type == "message" and item.role == "user")
+        if pending_turns < self.summarize_every and self._summarized_upto is not None:
+            return
+        if not pending:
+            return
+        self._summary_task = asyncio.create_task(self._refresh_summary(pending), name="chat_history_summary")
+
+    async def _refresh_summary(self, pending: List[Any]) -> None:
+        lines = [text for text in (_item_text(item) for item in pending) if text]
+        summary_ctx = llm.ChatContext.empty()
+        summary_ctx.add_message(role="system", content=SUMMARY_INSTRUCTIONS)
+        summary_ctx.add_message(
+            role="user",
+            content=f"Existing summary:\n{self.summary or '(none)'}\n\nNew conversation lines:\n" + "\n".join(lines),
+        )
+        try:
+            parts = []
+            async with self.summary_llm.chat(chat_ctx=summary_ctx) as stream:
+                async for chunk in stream:
+                    if chunk.delta and chunk.delta.content:
+                        parts.append(chunk.delta.content)
+            summary = "".join(parts).strip()
+        except Exception as e:
+            # keep the previous summary, the uncovered turns stay verbatim until the next attempt
+            logger.error(f"Failed to refresh chat summary: {e}")
+            return
+        if summary:
+            self.summary = summary
+            self._summarized_upto = pending[-1].id
+            logger.info(f"Chat summary refreshed with {len(lines)} lines, {len(summary)} chars")
+
+    def record_llm_metrics(self, prompt_tokens: int, ttft: float) -> None:
+        self.turns.append({"prompt_tokens": prompt_tokens, "ttft": ttft, "windowed": self._windowed})
+
+    def trend_report(self) -> Dict[str, Any]:
+        """Per-turn prompt size and TTFT, split by whether the history window was active."""
+        before = [turn for turn in self.turns if not turn["windowed"]]
+        after = [turn for turn in self.turns if turn["windowed"]]
+        return {
+            "turns": len(self.turns),
+            "prompt_tokens_per_turn": [turn["prompt_tokens"] for turn in self.turns],
+            "before_window": {
+                "prompt_tokens": distribution_summary([turn["prompt_tokens"] for turn in before]),
+                "ttft": distribution_summary([turn["ttft"] for turn in before]),
+                "prompt_tokens_slope": round(_linear_slope([turn["prompt_tokens"] for turn in before]), 1),
+            },
+            "after_window": {
+                "prompt_tokens": distribution_summary([turn["prompt_tokens"] for turn in after]),
+                "ttft": distribution_summary([turn["ttft"] for turn in after]),
+                "prompt_tokens_slope": round(_linear_slope([turn["prompt_tokens"] for turn in after]), 1),
+            },
+        }
+
+    async def aclose(self) -> None:
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+            try:
+                await self._summary_task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,162 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from metrics_utils import percentile, distribution_summary
+
+logger = logging.getLogger("my-worker")
+
+
+class EndpointingController:
+    """Adapts the AgentSession endpointing delays to the caller on the line.
+
+    Starts from the configured minimum endpointing delay and then:
+      - moves the minimum towards the caller's own mid-turn pauses (p90 plus a
+        margin), measured as the time from the caller going quiet to speaking
+        again before the agent replied; a caller who never pauses mid-turn
+        gives no samples and keeps the baseline
+      - raises both delays when the caller starts talking again shortly after the
+        agent took the turn (we cut them off mid-sentence)
+      - lowers the maximum when turns keep running into it, since that time is
+        spent waiting on a caller who has already finished
+
+    The "listening" and "speaking" user states fire when the VAD has seen
+    min_silence_duration of silence / min_speech_duration of speech, so both are
+    moved back by those durations. AudioRecognition times the endpointing delay
+    from the same point, the moment the caller actually went quiet. Pauses shorter
+    than min_silence_duration never end speech, so they never start that timer and
+    are not sampled.
+    """
+
+    def __init__(
+        self,
+        baseline_delay: float,
+        max_delay: float = 6.0,
+        min_floor_ratio: float = 0.5,
+        min_ceiling_ratio: float = 2.5,
+        max_floor: float = 1.5,
+        step: float = 0.1,
+        early_interruption_window: float = 1.5,
+        # covers the start-of-speech detection jitter (one ~32ms VAD frame on each
+        # side of min_speech_duration) plus the p90 spread of a 3-20 sample window
+        pause_margin: float = 0.15,
+        min_pause_samples: int = 3,
+        window: int = 20,
+        vad_silence_duration: float = 0.55,
+        vad_speech_duration: float = 0.05,
+    ) -> None:
+        self.baseline_delay = baseline_delay
+        self.min_floor = baseline_delay * min_floor_ratio
+        self.min_ceiling = baseline_delay * min_ceiling_ratio
+        self.max_ceiling = max_delay
+        self.max_floor = min(max(max_floor, self.min_ceiling), max_delay)
+        self.step = step
+        self.early_interruption_window = early_interruption_window
+        self.pause_margin = pause_margin
+        self.min_pause_samples = min_pause_samples
+        # Silero defaults, from_config callers pass the session VAD's own settings
+        self.vad_silence_duration = vad_silence_duration
+        self.vad_speech_duration = vad_speech_duration
+
+        self.min_delay = baseline_delay
+        self.max_delay = max_delay
+
+        self.eou_delays: Deque[float] = deque(maxlen=window)
+        self.pauses: Deque[float] = deque(maxlen=window)
+        self.early_interruptions = 0
+        self.interruptions = 0
+        self.turn_gaps: List[float] = []
+
+        self._user_stopped_at: Optional[float] = None
+        self._agent_started_at: Optional[float] = None
+        self._interrupted_since_last_eou = False
+
+    @classmethod
+    def from_config(cls, baseline_delay: float, endpointing_config: Dict[str, Any], max_delay: float, vad=None):
+        options = {k: v for k, v in endpointing_config.items() if k != "enabled"}
+        # silero.VAD keeps its thresholds in _opts; other VADs keep the Silero defaults
+        vad_opts = getattr(vad, "_opts", None)
+        if hasattr(vad_opts, "min_silence_duration"):
+            options.setdefault("vad_silence_duration", vad_opts.min_silence_duration)
+        if hasattr(vad_opts, "min_speech_duration"):
+            options.setdefault("vad_speech_duration", vad_opts.min_speech_duration)
+        return cls(baseline_delay, max_delay=max_delay, **options)
+
+    def on_user_state_changed(self, new_state: str, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        if new_state == "speaking":
+            if self._user_stopped_at is not None:
+                # the caller resumed before the agent replied, a mid-turn pause
+                self.pauses.append(max(0.0, now - self.vad_speech_duration - self._user_stopped_at))
+            self._user_stopped_at = None
+            if self._agent_started_at is not None:
+                # the caller talked over the agent's reply
+                self.interruptions += 1
+                if now - self._agent_started_at <= self.early_interruption_window:
+                    self.early_interruptions += 1
+                    self._interrupted_since_last_eou = True
+                    self._adjust(self.step * 2, 0.5, reason="early interruption")
+        elif new_state == "listening":
+            # when the caller actually went quiet, not when the VAD noticed
+            self._user_stopped_at = now - self.vad_silence_duration
+
+    def on_agent_state_changed(self, new_state: str, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        if new_state == "speaking":
+            self._agent_started_at = now
+            if self._user_stopped_at is not None:
+                self.turn_gaps.append(now - self._user_stopped_at)
+                self._user_stopped_at = None
+        else:
+            self._agent_started_at = None
+
+    def observe_eou(self, end_of_utterance_delay: float) -> None:
+        self.eou_delays.append(end_of_utterance_delay)
+        interrupted = self._interrupted_since_last_eou
+        self._interrupted_since_last_eou = False
+        if interrupted:
+            return
+
+        if len(self.pauses) >= self.min_pause_samples:
+            # one step per turn towards what this caller's pauses need
+            target = percentile(self.pauses, 0.9) + self.pause_margin
+            change = max(-self.step, min(self.step, target - self.min_delay))
+            self._adjust(change, 0.0, reason="caller pauses")
+
+        tolerance = self.step / 2
+        if len(self.eou_delays) >= 3 and percentile(self.eou_delays, 0.5) >= self.max_delay - tolerance:
+            # most turns only end once the maximum delay expires
+            self._adjust(0.0, -0.5, reason="turns hitting max delay")
+
+    def _adjust(self, min_change: float, max_change: float, reason: str) -> None:
+        min_delay = min(self.min_ceiling, max(self.min_floor, self.min_delay + min_change))
+        max_delay = min(self.max_ceiling, max(self.max_floor, self.max_delay + max_change))
+        if (min_delay, max_delay) != (self.min_delay, self.max_delay):
+            logger.info(
+                f"Endpointing delays ({reason}): min {self.min_delay:.2f}s -> {min_delay:.2f}s, "
+                f"max {self.max_delay:.2f}s -> {max_delay:.2f}s"
+            )
+        self.min_delay, self.max_delay = min_delay, max_delay
+
+    def apply(self, session) -> None:
+        """Pushes the current delays into the running AgentSession."""
+        session.options.min_endpointing_delay = self.min_delay
+        session.options.max_endpointing_delay = self.max_delay
+        # AudioRecognition copies the delays when the agent activity starts, so the
+        # running instance has to be updated as well for the change to apply now
+        activity = getattr(session, "_activity", None)
+        audio_recognition = getattr(activity, "_audio_recognition", None)
+        if audio_recognition is not None:
+            audio_recognition._min_endpointing_delay = self.min_delay
+            audio_recognition._max_endpointing_delay = self.max_delay
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "min_endpointing_delay": round(self.min_delay, 3),
+            "max_endpointing_delay": round(self.max_delay, 3),
+            "interruptions": self.interruptions,
+            "early_interruptions": self.early_interruptions,
+            "caller_pause": distribution_summary(list(self.pauses)),
+            "turn_gap": distribution_summary(self.turn_gaps),
+        }
@@ -0,0 +1,213 @@
+import importlib
+import logging
+from copy import deepcopy
+from typing import Any, Dict, List, Tuple
+
+# The turn detector registers its inference runner at import time, and that has to
+# happen in the worker's main process, so it is the one plugin imported eagerly.
+# The default pipeline's provider plugins are imported by prewarm while the job
+# process is idle; providers only an agent_config override uses are imported when
+# a call asks for them.
+from livekit.plugins.turn_detector.multilingual import MultilingualModel
+
+logger = logging.getLogger("my-worker")
+
+
+# Defaults match the pipeline that used to be hard-coded in agent2.entrypoint.
+# An agent_config may override any of these through its "pipeline" section, e.g.
+#   {"pipeline": {"llm": {"provider": "groq", "model": "llama-3.1-8b-instant"},
+#                 "stt": {"endpointing_ms": 10},
+#                 "tts": {"chunk_length_schedule": [50, 80, 150, 200]}}}
+# Every key except "provider" is passed straight through to the plugin constructor.
+DEFAULT_PIPELINE_CONFIG: Dict[str, Dict[str, Any]] = {
+    "stt": {
+        "provider": "deepgram",
+        "model": "nova-2-general",
+        "language": "hi",
+    },
+    "llm": {
+        "provider": "openai",
+        "model": "gpt-4o-mini",
+    },
+    "tts": {
+        "provider": "elevenlabs",
+        "voice_id": "NeDTo4pprKj2ZwuNJceH",
+        "model": "eleven_flash_v2_5",
+        "chunk_length_schedule": [50, 100, 200, 260],
+    },
+    # AgentSession turn-taking knobs
+    "turn": {
+        "min_endpointing_delay": 0.5,
+        "max_endpointing_delay": 6.0,
+    },
+    # Sliding window of recent turns plus a rolling summary of older ones, see chat_history.py
+    "history": {
+        "enabled": True,
+        "keep_turns": 6,
+        "summarize_every": 4,
+        "summary_llm": {"provider": "openai", "model": "gpt-4o-mini"},
+    },
+    # Per-caller endpointing delays, baseline is turn.min_endpointing_delay when the agent_config
+    # sets it and SILENCE_DETECTION_THRESHOLD otherwise, see endpointing.py
+    "adaptive_endpointing": {
+        "enabled": True,
+        "min_floor_ratio": 0.5,
+        "min_ceiling_ratio": 2.5,
+        "early_interruption_window": 1.5,
+    },
+    # Per-session chunk_length_schedule tuning from live TTFB samples, see tts_scheduling.py
+    "adaptive_tts": {
+        "enabled": False,
+        "min_first_chunk": 50,
+        "max_first_chunk": 120,
+        "max_chunk": 300,
+    },
+}
+
+# provider name -> (livekit.plugins module, class name)
+STT_PROVIDERS: Dict[str, Tuple[str, str]] = {
+    "deepgram": ("deepgram", "STT"),
+    "groq": ("groq", "STT"),
+    "openai": ("openai", "STT"),
+}
+
+LLM_PROVIDERS: Dict[str, Tuple[str, str]] = {
+    "openai": ("openai", "LLM"),
+    "groq": ("groq", "LLM"),
+}
+
+TTS_PROVIDERS: Dict[str, Tuple[str, str]] = {
+    "elevenlabs": ("elevenlabs", "TTS"),
+    "cartesia": ("cartesia", "TTS"),
+    "openai": ("openai", "TTS"),
+}
+
+# plugin kwargs that must not end up in the logs, matched exactly or as a suffix
+SECRET_KEY_NAMES = ("key", "token", "secret", "password", "credentials")
+
+# Silero VAD loaded by prewarm, the job entrypoint runs in the same process
+_vad = None
+
+
+def resolve_pipeline_config(agent_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Merges the agent_config "pipeline" overrides on top of the defaults."""
+    resolved = deepcopy(DEFAULT_PIPELINE_CONFIG)
+    overrides = agent_config.get("pipeline") if isinstance(agent_config, dict) else None
+    if not overrides:
+        return resolved
+    if not isinstance(overrides, dict):
+        logger.warning(f"Ignoring pipeline config of type {type(overrides).__name__}, expected an object")
+        return resolved
+    for section, values in overrides.items():
+        if section not in resolved or not isinstance(values, dict):
+            logger.warning(f"Ignoring unknown pipeline config section: {section}")
+            continue
+        # switching provider drops the defaults that belong to the old one
+        if values.get("provider") and values["provider"] != resolved[section].get("provider"):
+            resolved[section] = {}
+        resolved[section].update({k: v for k, v in values.items() if v is not None})
+    return resolved
+
+
+def redact_config(config: Any) -> Any:
+    """Copy of a config with secret-looking values (api_key, token, secret, ...) masked, for logging."""
+    if isinstance(config, dict):
+        redacted = {}
+        for key, value in config.items():
+            name = str(key).lower()
+            if any(name == secret or name.endswith(f"_{secret}") for secret in SECRET_KEY_NAMES):
+                redacted[key] = "***"
+            else:
+                redacted[key] = redact_config(value)
+        return redacted
+    if isinstance(config, list):
+        return [redact_config(value) for value in config]
+    return config
+
+
+def pipeline_override(agent_config: Dict[str, Any], section: str, key: str) -> Any:
+    """Returns a value the agent_config sets explicitly in its "pipeline" section, or None."""
+    overrides = agent_config.get("pipeline") if isinstance(agent_config, dict) else None
+    values = overrides.get(section) if isinstance(overrides, dict) else None
+    return values.get(key) if isinstance(values, dict) else None
+
+
+def _import_plugin_class(module_name: str, class_name: str):
+    """Imports livekit.plugins.<module_name> on first use.
+
+    Plugins register themselves on import and that must happen on the main thread,
+    which is where the job entrypoint runs with the default process executor.
+    """
+    module = importlib.import_module(f"livekit.plugins.{module_name}")
+    return getattr(module, class_name)
+
+
+def _build_plugin(kind: str, providers: Dict[str, Tuple[str, str]], section_config: Dict[str, Any]):
+    # with the default process executor every job gets a fresh process, so plugin
+    # instances are built per call rather than cached
+    options = dict(section_config)
+    provider = options.pop("provider", None)
+    if provider not in providers:
+        raise ValueError(f"Unsupported {kind} provider: {provider}")
+
+    instance = _import_plugin_class(*providers[provider])(**options)
+    logger.info(f"Built {kind} plugin {provider} with options: {redact_config(options)}")
+    return instance
+
+
+def build_stt(stt_config: Dict[str, Any]):
+    return _build_plugin("stt", STT_PROVIDERS, stt_config)
+
+
+def build_llm(llm_config: Dict[str, Any]):
+    return _build_plugin("llm", LLM_PROVIDERS, llm_config)
+
+
+def build_tts(tts_config: Dict[str, Any]):
+    return _build_plugin("tts", TTS_PROVIDERS, tts_config)
+
+
+def load_vad():
+    """Silero VAD is loaded once per process; the model weights are config independent."""
+    global _vad
+    if _vad is None:
+        _vad = _import_plugin_class("silero", "VAD").load()
+    return _vad
+
+
+def default_plugin_modules() -> List[Tuple[str, str]]:
+    """The (module, class) pairs the default pipeline and history summary use."""
+    sections = (
+        (STT_PROVIDERS, DEFAULT_PIPELINE_CONFIG["stt"]),
+        (LLM_PROVIDERS, DEFAULT_PIPELINE_CONFIG["llm"]),
+        (TTS_PROVIDERS, DEFAULT_PIPELINE_CONFIG["tts"]),
+        (LLM_PROVIDERS, DEFAULT_PIPELINE_CONFIG["history"]["summary_llm"]),
+    )
+    modules = []
+    for providers, section_config in sections:
+        if providers[section_config["provider"]] not in modules:
+            modules.append(providers[section_config["provider"]])
+    return modules
+
+
+def prewarm(proc) -> None:
+    """WorkerOptions.prewarm_fnc: loads the VAD and imports the default providers while the process is idle.
+
+    Job processes are spawned and single use, so a plugin not imported here is
+    imported after ctx.connect(), on the call's time-to-greeting path.
+    """
+    load_vad()
+    for module_name, class_name in default_plugin_modules():
+        _import_plugin_class(module_name, class_name)
+
+
+def build_session_options(pipeline_config: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Returns the keyword arguments for AgentSession built from a resolved pipeline config."""
+    return {
+        "stt": build_stt(pipeline_config["stt"]),
+        "llm": build_llm(pipeline_config["llm"]),
+        "tts": build_tts(pipeline_config["tts"]),
+        "vad": load_vad(),
+        "turn_detection": MultilingualModel(),
+        **pipeline_config["turn"],
+    }
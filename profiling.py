@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional
+
+import psutil
+
+logger = logging.getLogger("my-worker")
+
+# Opt-in switches, everything here is off unless PROFILING_ENABLED=1
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# tracemalloc slows down every allocation, so it has its own switch
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "0") == "1"
+# event-loop stalls longer than this are logged with the loop thread's stack
+LOOP_LAG_WARN = float(os.getenv("LOOP_LAG_WARN", "0.1"))
+# `kill -USR1 <job pid>` records a CPU profile for this many seconds
+CPU_PROFILE_SECONDS = float(os.getenv("CPU_PROFILE_SECONDS", "10"))
+CPU_PROFILE_HZ = 100
+PROFILE_DUMP_DIR = os.getenv("PROFILE_DUMP_DIR", tempfile.gettempdir())
+
+
+class LoopLagMonitor:
+    """Watchdog thread that detects event-loop stalls and samples the blocked stack.
+
+    A heartbeat task stamps the time on every loop iteration it gets; the watchdog
+    thread only reads that timestamp, so the loop pays one cheap callback per
+    interval and the stack is captured while the slow callback is still running.
+    """
+
+    def __init__(self, threshold: float = LOOP_LAG_WARN, interval: float = 0.05) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.max_stall = 0.0
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._task = asyncio.create_task(self._beat(), name="loop_lag_heartbeat")
+        self._thread = threading.Thread(target=self._watch, daemon=True, name="loop_lag_watchdog")
+        self._thread.start()
+
+    async def _beat(self) -> None:
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        reported_for = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stall = time.monotonic() - heartbeat - self.interval
+            if stall < self.threshold:
+                continue
+            self.max_stall = max(self.max_stall, stall)
+            # one stack sample per stall is enough to find the culprit
+            if reported_for == heartbeat:
+                continue
+            reported_for = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(f"Event loop blocked for at least {stall * 1000:.0f}ms, loop thread stack:\n{stack}")
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+class CpuSampler:
+    """Sampling CPU profiler for the event-loop thread, output in folded-stack format."""
+
+    def __init__(self, thread_id: int, duration: float = CPU_PROFILE_SECONDS, hz: int = CPU_PROFILE_HZ) -> None:
+        self.thread_id = thread_id
+        self.duration = duration
+        self.hz = hz
+        self._running = threading.Lock()
+
+    def trigger(self, label: str) -> None:
+        if not self._running.acquire(blocking=False):
+            logger.info("CPU profile already running, ignoring trigger")
+            return
+        threading.Thread(target=self._run, args=(label,), daemon=True, name="cpu_sampler").start()
+
+    def _run(self, label: str) -> None:
+        try:
+            samples: Counter = Counter()
+            deadline = time.monotonic() + self.duration
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    samples[";".join(reversed(stack))] += 1
+                time.sleep(1 / self.hz)
+
+            path = os.path.join(PROFILE_DUMP_DIR, f"cpu-profile-{label}-{int(time.time())}.folded")
+            with open(path, "w") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            logger.info(f"CPU profile with {sum(samples.values())} samples written to {path}")
+        except Exception as e:
+            logger.error(f"CPU profile failed: {e}")
+        finally:
+            self._running.release()
+
+
+def describe_open_clients(clients: Dict[str, Any]) -> Dict[str, bool]:
+    """Maps each client name to whether it is still open (httpx and LiveKitAPI)."""
+    still_open = {}
+    for name, client in clients.items():
+        if hasattr(client, "is_closed"):
+            still_open[name] = not client.is_closed
+        elif getattr(client, "_session", None) is not None:
+            still_open[name] = not client._session.closed
+    return still_open
+
+
+class JobProfiler:
+    """Per-job profiling surface: loop stalls, CPU and memory per session, leaks.
+
+    Meant to run in production when PROFILING_ENABLED=1: the loop monitor and the
+    CPU/RSS accounting cost next to nothing, tracemalloc and CPU sampling only run
+    when explicitly enabled or triggered.
+    """
+
+    def __init__(self, job_id: str, trace_memory: bool = PROFILE_TRACEMALLOC) -> None:
+        self.job_id = job_id
+        self.trace_memory = trace_memory
+        self.loop_monitor = LoopLagMonitor()
+        self._process = psutil.Process()
+        self._started_at = 0.0
+        self._cpu_start = 0.0
+        self._rss_start = 0
+        self._snapshot_start: Optional[tracemalloc.Snapshot] = None
+        self._sampler: Optional[CpuSampler] = None
+
+    def start(self) -> None:
+        self._started_at = time.monotonic()
+        cpu = self._process.cpu_times()
+        self._cpu_start = cpu.user + cpu.system
+        self._rss_start = self._process.memory_info().rss
+        self.loop_monitor.start()
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            self._snapshot_start = tracemalloc.take_snapshot()
+
+        self._sampler = CpuSampler(threading.get_ident())
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self._sampler.trigger(self.job_id))
+            logger.info(f"Profiling enabled for job {self.job_id}, send SIGUSR1 to pid {os.getpid()} for a CPU profile")
+        except (ValueError, AttributeError) as e:
+            # not the main thread (thread executor) or no SIGUSR1 on this platform
+            logger.warning(f"CPU profile signal trigger unavailable: {e}")
+
+    def report(self, clients: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        cpu = self._process.cpu_times()
+        rss_end = self._process.memory_info().rss
+        wall = time.monotonic() - self._started_at
+        # with the process executor every job has its own process, so this is per session
+        cpu_seconds = cpu.user + cpu.system - self._cpu_start
+        report = {
+            "job_id": self.job_id,
+            "wall_seconds": round(wall, 2),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "cpu_percent": round(100 * cpu_seconds / wall, 1) if wall > 0 else 0.0,
+            "rss_start_mb": round(self._rss_start / 2**20, 1),
+            "rss_end_mb": round(rss_end / 2**20, 1),
+            "loop_stalls": self.loop_monitor.stalls,
+            "max_loop_stall_ms": round(self.loop_monitor.max_stall * 1000),
+        }
+        if clients:
+            report["open_clients"] = [name for name, is_open in describe_open_clients(clients).items() if is_open]
+        return report
+
+    def log_memory_growth(self, limit: int = 10) -> None:
+        if self._snapshot_start is None:
+            return
+        # the stack samples logged by the loop monitor pull source lines into linecache
+        noise = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>"),
+                 tracemalloc.Filter(False, "*/linecache.py"), tracemalloc.Filter(False, "*/traceback.py")]
+        snapshot_end = tracemalloc.take_snapshot().filter_traces(noise)
+        stats = snapshot_end.compare_to(self._snapshot_start.filter_traces(noise), "lineno")
+        growth = sum(stat.size_diff for stat in stats)
+        lines = [str(stat) for stat in stats[:limit] if stat.size_diff > 0]
+        logger.info(f"Memory growth during job {self.job_id}: {growth / 1024:.1f} KiB, top allocations:\n" + "\n".join(lines))
+
+    async def aclose(self, clients: Optional[Dict[str, Any]] = None) -> None:
+        await self.loop_monitor.aclose()
+        self.log_memory_growth()
+        logger.info(f"Job profile: {self.report(clients)}")
+        if self.trace_memory:
+            tracemalloc.stop()
@@ -0,0 +1,233 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger("my-worker")
+
+# Local append-only spool, one <call_id>.jsonl per call plus a <call_id>.ack holding
+# the last sequence number the backend accepted
+SPOOL_DIR = os.getenv("CALL_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "lk-call-spool"))
+SPOOL_BATCH_SIZE = int(os.getenv("CALL_SPOOL_BATCH_SIZE", "20"))
+SPOOL_FLUSH_INTERVAL = float(os.getenv("CALL_SPOOL_FLUSH_INTERVAL", "2.0"))
+# the end-of-call flush gives up after this long and leaves the rest for replay
+SPOOL_CLOSE_TIMEOUT = float(os.getenv("CALL_SPOOL_CLOSE_TIMEOUT", "5.0"))
+SPOOL_MAX_BACKOFF = 30.0
+# separates the call id from the suffix of a fallback spool, <call_id>~<suffix>.jsonl
+SPOOL_SUFFIX_SEP = "~"
+
+
+def spool_endpoint(backend_url: str, call_id: str) -> str:
+    return f"{backend_url}/callAnalysis/events/{call_id}"
+
+
+def _read_ack(ack_path: str) -> int:
+    try:
+        with open(ack_path) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_ack(ack_path: str, seq: int) -> None:
+    tmp_path = f"{ack_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(seq))
+    os.replace(tmp_path, ack_path)
+
+
+def _read_records(spool_path: str, after_seq: int) -> List[Dict[str, Any]]:
+    records = []
+    with open(spool_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # torn last line from a crash mid-write
+                continue
+            if record["seq"] > after_seq:
+                records.append(record)
+    return records
+
+
+def _lock_spool(spool_path: str):
+    """Opens the spool for appending with an exclusive lock, or returns None if another job holds it."""
+    f = open(spool_path, "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    _truncate_torn_tail(spool_path)
+    return f
+
+
+def _truncate_torn_tail(spool_path: str) -> None:
+    """Drops a partial last line left by a crash mid-write, so the next append starts on a fresh line."""
+    with open(spool_path, "rb") as f:
+        data = f.read()
+    if data and not data.endswith(b"\n"):
+        keep = data.rfind(b"\n") + 1
+        logger.warning(f"Dropping {len(data) - keep} bytes of a torn record at the end of {spool_path}")
+        os.truncate(spool_path, keep)
+
+
+async def _post_batch(httpclient: httpx.AsyncClient, url: str, records: List[Dict[str, Any]]) -> None:
+    response = await httpclient.post(url, json={"events": records})
+    response.raise_for_status()
+
+
+class CallSpool:
+    """Streams call turns, tool results and usage metrics to the backend.
+
+    `record()` only appends a line to the local spool file, so it never waits on
+    the network and is safe to call from session event handlers. A background task
+    sends unacknowledged records in small batches and backs off while the backend
+    is down. Whatever is not acknowledged when the call ends stays on disk and is
+    sent by `replay_pending_spools()` from a later job.
+    Delivery is at least once; the backend should dedupe on (call_id, seq).
+    """
+
+    def __init__(self, call_id: str, backend_url: str, httpclient: httpx.AsyncClient) -> None:
+        self.call_id = call_id
+        self.url = spool_endpoint(backend_url, call_id)
+        self.httpclient = httpclient
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        self.spool_path = os.path.join(SPOOL_DIR, f"{call_id}.jsonl")
+        self.ack_path = os.path.join(SPOOL_DIR, f"{call_id}.ack")
+
+        # the lock is held for the whole call so replay in other jobs leaves this spool alone
+        self._file = _lock_spool(self.spool_path)
+        self._pending: List[Dict[str, Any]] = []
+        if self._file is not None:
+            self._acked = _read_ack(self.ack_path)
+            # a re-dispatched call picks up where its previous job left off
+            self._pending = _read_records(self.spool_path, self._acked)
+            self._seq = self._pending[-1]["seq"] if self._pending else self._acked
+        else:
+            # another job is replaying this call's spool and sends those records;
+            # this call writes a fresh spool numbered after them so none are deduped away
+            records = _read_records(self.spool_path, 0)
+            self._acked = self._seq = records[-1]["seq"] if records else 0
+            base = f"{call_id}{SPOOL_SUFFIX_SEP}{int(time.time() * 1000)}"
+            self.spool_path = os.path.join(SPOOL_DIR, f"{base}.jsonl")
+            self.ack_path = os.path.join(SPOOL_DIR, f"{base}.ack")
+            self._file = _lock_spool(self.spool_path)
+            if self._file is None:
+                raise RuntimeError(f"Spool {self.spool_path} is locked by another job")
+            logger.info(f"Spool for call {call_id} is being replayed, writing to {self.spool_path}")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="call_spool_sender")
+
+    def record(self, kind: str, data: Dict[str, Any]) -> None:
+        if self._file.closed:
+            return
+        self._seq += 1
+        record = {"seq": self._seq, "call_id": self.call_id, "kind": kind, "ts": time.time(), "data": data}
+        try:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            # flushed to the OS so it survives a worker crash
+            self._file.flush()
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to spool {kind} record: {e}")
+            return
+        self._pending.append(record)
+        if len(self._pending) >= SPOOL_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def _send_pending(self) -> None:
+        while self._pending:
+            batch = self._pending[:SPOOL_BATCH_SIZE]
+            await _post_batch(self.httpclient, self.url, batch)
+            del self._pending[:len(batch)]
+            self._acked = batch[-1]["seq"]
+            _write_ack(self.ack_path, self._acked)
+
+    async def _run(self) -> None:
+        backoff = SPOOL_FLUSH_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._send_pending()
+                backoff = SPOOL_FLUSH_INTERVAL
+            except Exception as e:
+                backoff = min(backoff * 2, SPOOL_MAX_BACKOFF)
+                logger.warning(f"Spool upload failed ({len(self._pending)} pending), retrying in {backoff:.1f}s: {e}")
+
+    async def aclose(self, timeout: float = SPOOL_CLOSE_TIMEOUT) -> None:
+        """Final flush bounded by timeout; unsent records stay on disk for replay."""
+        if self._file.closed:
+            return
+        self.record("end", {})
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await asyncio.wait_for(self._send_pending(), timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Spool flush for call {self.call_id} incomplete, {len(self._pending)} records left for replay: {e}")
+        self._file.close()
+        if not self._pending:
+            _remove_spool(self.spool_path, self.ack_path)
+        logger.info(f"Call spool closed for {self.call_id}, last acked seq {self._acked}/{self._seq}")
+
+
+def _remove_spool(spool_path: str, ack_path: str) -> None:
+    for path in (spool_path, ack_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def replay_pending_spools(backend_url: str, httpclient: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    """Sends spools left behind by crashed or timed-out jobs. Spools locked by a live call are skipped."""
+    if not os.path.isdir(SPOOL_DIR):
+        return
+
+    async def _replay():
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            if not name.endswith(".jsonl"):
+                continue
+            base = name[: -len(".jsonl")]
+            call_id = base.split(SPOOL_SUFFIX_SEP)[0]
+            spool_path = os.path.join(SPOOL_DIR, name)
+            ack_path = os.path.join(SPOOL_DIR, f"{base}.ack")
+            try:
+                with open(spool_path) as f:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                    records = _read_records(spool_path, _read_ack(ack_path))
+                    url = spool_endpoint(backend_url, call_id)
+                    for i in range(0, len(records), SPOOL_BATCH_SIZE):
+                        batch = records[i:i + SPOOL_BATCH_SIZE]
+                        await _post_batch(httpclient, url, batch)
+                        _write_ack(ack_path, batch[-1]["seq"])
+                    _remove_spool(spool_path, ack_path)
+            except FileNotFoundError:
+                # removed by the job that owned it since listdir
+                continue
+            logger.info(f"Replayed {len(records)} spooled records for call {call_id}")
+
+    try:
+        await asyncio.wait_for(_replay(), timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Spool replay stopped, will retry on the next job: {e}")
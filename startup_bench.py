@@ -0,0 +1,191 @@
+"""Worker cold-start benchmark.
+
+Measures, for each agent module, what a freshly spawned job process pays before
+it can take a call:
+  - `python -X importtime` breakdown: total import time and the heaviest packages
+  - wall time to spawn an interpreter and import the module, median of N runs
+  - peak RSS of that idle process
+  - provider plugin import time, split into what prewarm pays while the
+    process is idle (default pipeline) and what each other provider adds after
+    ctx.connect() when a call's agent_config selects it
+
+Provider plugins are imported lazily, so the module import above no longer
+includes them. That cost is not gone: for the default pipeline it moved into
+prewarm, for override providers it moved onto the time-to-greeting path.
+
+Usage:
+    python startup_bench.py [--modules agent2 agent] [--runs 5] [--top 15] [--output bench.jsonl]
+
+Each module result is printed and, with --output, appended as one JSON line so
+cold-start and idle memory can be tracked over time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# agent2 reads these at import time
+BENCH_ENV = {"SILENCE_DETECTION_THRESHOLD": "500"}
+
+SPAWN_SNIPPET = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+plugins = sorted(name for name in sys.modules if name.startswith("livekit.plugins."))
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "plugins": sorted({{name.split(".")[2] for name in plugins}}),
+}}))
+"""
+
+
+PLUGIN_SNIPPET = """
+import json, time
+import {module}
+import pipeline
+start = time.perf_counter()
+for module_name, class_name in pipeline.default_plugin_modules():
+    pipeline._import_plugin_class(module_name, class_name)
+prewarm = time.perf_counter() - start
+on_call = {{}}
+for providers in (pipeline.STT_PROVIDERS, pipeline.LLM_PROVIDERS, pipeline.TTS_PROVIDERS):
+    for module_name, class_name in providers.values():
+        if module_name in on_call or (module_name, class_name) in pipeline.default_plugin_modules():
+            continue
+        start = time.perf_counter()
+        pipeline._import_plugin_class(module_name, class_name)
+        on_call[module_name] = time.perf_counter() - start
+print(json.dumps({{"prewarm_seconds": prewarm, "on_call_seconds": on_call}}))
+"""
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    for key, value in BENCH_ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parses `-X importtime` lines into {module, self_us, cumulative_us, depth}."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            # importtime indents nested imports by two spaces per level
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return entries
+
+
+def run_importtime(module: str, top: int) -> Dict[str, Any]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=_env(),
+    )
+    entries = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        return {"error": error}
+
+    root = next((e for e in entries if e["module"] == module), None)
+    # heaviest top-level packages by cumulative time
+    packages: Dict[str, int] = {}
+    for entry in entries:
+        if entry["depth"] == 0:
+            package = entry["module"].split(".")[0]
+            packages[package] = packages.get(package, 0) + entry["cumulative_us"]
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "total_import_ms": round(sum(e["cumulative_us"] for e in entries if e["depth"] == 0) / 1000, 1),
+        "module_import_ms": round(root["cumulative_us"] / 1000, 1) if root else None,
+        "modules_imported": len(entries),
+        "heaviest_packages_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+
+def run_spawn(module: str, runs: int) -> Dict[str, Any]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", SPAWN_SNIPPET.format(module=module)],
+            capture_output=True, text=True, env=_env(),
+        )
+        wall = time.perf_counter() - start
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+            return {"error": error}
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["spawn_seconds"] = wall
+        samples.append(sample)
+
+    return {
+        "runs": runs,
+        "spawn_ms_median": round(statistics.median(s["spawn_seconds"] for s in samples) * 1000, 1),
+        "import_ms_median": round(statistics.median(s["import_seconds"] for s in samples) * 1000, 1),
+        "idle_rss_mb_median": round(statistics.median(s["max_rss_mb"] for s in samples), 1),
+        "plugins_at_import": samples[-1]["plugins"],
+    }
+
+
+def run_plugin_imports(module: str, runs: int) -> Dict[str, Any]:
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PLUGIN_SNIPPET.format(module=module)],
+            capture_output=True, text=True, env=_env(),
+        )
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+            return {"error": error}
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    on_call_names = samples[-1]["on_call_seconds"].keys()
+    return {
+        "runs": runs,
+        "prewarm_import_ms_median": round(statistics.median(s["prewarm_seconds"] for s in samples) * 1000, 1),
+        # a provider that is not imported already is paid on the call's time-to-greeting path
+        "on_call_import_ms_median": {
+            name: round(statistics.median(s["on_call_seconds"][name] for s in samples) * 1000, 1)
+            for name in on_call_names
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["agent2", "agent"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        result = {
+            "module": module,
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "importtime": run_importtime(module, args.top),
+            "spawn": run_spawn(module, args.runs),
+            "plugin_imports": run_plugin_imports(module, args.runs),
+        }
+        print(json.dumps(result, indent=2))
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from livekit import api
+
+from metrics_utils import percentile
+
+logger = logging.getLogger("my-worker")
+
+# upper bound for cancelling the session and stopping egress after a hangup
+TEARDOWN_TIMEOUT = float(os.getenv("TEARDOWN_TIMEOUT", "5.0"))
+# how long the interrupted reply gets to close its LLM stream and report usage
+INTERRUPT_TIMEOUT = float(os.getenv("TEARDOWN_INTERRUPT_TIMEOUT", "1.0"))
+
+
+class CallTeardown:
+    """Releases the job slot as soon as the caller hangs up.
+
+    Cancels the in-flight reply (LLM stream, TTS synthesis and tool calls all run
+    inside the session's speech tasks), stops the egress recording and shuts the
+    job down, each step bounded so a stuck provider cannot hold the slot. The
+    shutdown callbacks then flush metrics and close the HTTP clients.
+    """
+
+    def __init__(self, timeout: float = TEARDOWN_TIMEOUT) -> None:
+        self.timeout = timeout
+        self.hangup_at: Optional[float] = None
+        self.reply_in_flight = False
+        self.completion_tokens: Deque[int] = deque(maxlen=20)
+        self.tokens_after_hangup = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self.hangup_at is not None
+
+    def observe_llm(self, completion_tokens: int, cancelled: bool) -> None:
+        if self.started:
+            # partial output of the reply that was cancelled by the teardown
+            self.tokens_after_hangup += completion_tokens
+        elif not cancelled:
+            self.completion_tokens.append(completion_tokens)
+
+    def start(self, ctx, session, lkapi, egress_id: Optional[str]) -> None:
+        if self.started:
+            return
+        self.hangup_at = time.monotonic()
+        # once the agent is speaking the LLM has usually finished generating, so only
+        # a reply still being generated can save completion tokens
+        self.reply_in_flight = session is not None and session.agent_state == "thinking"
+        self._task = asyncio.create_task(self._run(ctx, session, lkapi, egress_id), name="call_teardown")
+
+    async def _step(self, name: str, coro, timeout: Optional[float] = None) -> None:
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Teardown step {name} timed out after {timeout}s")
+        except Exception as e:
+            logger.error(f"Teardown step {name} failed: {str(e)}")
+
+    async def _run(self, ctx, session, lkapi, egress_id: Optional[str]) -> None:
+        if session is not None:
+            interrupted = None
+            try:
+                interrupted = session.interrupt()
+            except RuntimeError:
+                # session not running yet or already closed
+                pass
+            if interrupted is not None:
+                # aclose() detaches the metrics listeners right away, so let the cancelled
+                # reply close its LLM stream and report its partial LLMMetrics first
+                await self._step("interrupt", asyncio.shield(interrupted), timeout=min(INTERRUPT_TIMEOUT, self.timeout))
+            await self._step("session.aclose", session.aclose())
+        if lkapi is not None and egress_id:
+            await self._step("stop_egress", lkapi.egress.stop_egress(api.StopEgressRequest(egress_id=egress_id)))
+        logger.info(f"Teardown done in {self.elapsed():.2f}s, shutting down job")
+        ctx.shutdown(reason="participant disconnected")
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.hangup_at if self.hangup_at is not None else 0.0
+
+    def report(self) -> Dict[str, Any]:
+        """Hangup-to-slot-free latency and the completion tokens the cancelled reply did not use.
+
+        estimated_tokens_avoided is the median completion length of this call's
+        earlier replies minus what the cancelled reply had generated, and only
+        counts when the hangup came while the agent was still thinking.
+        """
+        tokens_avoided = 0
+        if self.reply_in_flight and self.completion_tokens:
+            expected = percentile(self.completion_tokens, 0.5)
+            tokens_avoided = max(0, int(expected) - self.tokens_after_hangup)
+        return {
+            "hangup_to_slot_free_seconds": round(self.elapsed(), 3),
+            "reply_in_flight": self.reply_in_flight,
+            "tokens_after_hangup": self.tokens_after_hangup,
+            "estimated_tokens_avoided": tokens_avoided,
+        }
@@ -0,0 +1,193 @@
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from metrics_utils import percentile
+
+logger = logging.getLogger("my-worker")
+
+# ElevenLabs only accepts chunk lengths in the [50, 500] range
+ELEVENLABS_MIN_CHUNK = 50
+ELEVENLABS_MAX_CHUNK = 500
+
+# Rough conversion factors used to turn token rates into character rates
+CHARS_PER_TOKEN = 4.0
+# How fast the synthesized voice consumes text (Hindi/Hinglish at normal pace)
+SPEECH_CHARS_PER_SECOND = 14.0
+
+FIXED_CHUNK_SCHEDULE = [50, 100, 200, 260]
+
+
+class AdaptiveChunkScheduler:
+    """Tunes the ElevenLabs chunk_length_schedule for a single session.
+
+    This does not lower time to first audio: ElevenLabs rejects chunks below 50
+    characters and the fixed schedule already starts at 50, so the first chunk
+    can only stay there or grow. What it trades is chunk count against stalls:
+    the first chunk grows when its playback would not cover receiving and
+    synthesizing the next one (slow LLM or TTS, fewer stalls at the cost of a
+    later start), and later chunks grow while the LLM produces text faster than
+    the voice speaks it (fewer chunk boundaries on long replies).
+    """
+
+    def __init__(
+        self,
+        min_first_chunk: int = ELEVENLABS_MIN_CHUNK,
+        max_first_chunk: int = 120,
+        max_chunk: int = 300,
+        schedule_length: int = 4,
+        window: int = 10,
+        ttfb_headroom: float = 1.3,
+        initial_schedule: Optional[List[int]] = None,
+    ) -> None:
+        self.min_first_chunk = max(ELEVENLABS_MIN_CHUNK, int(min_first_chunk))
+        self.max_first_chunk = max(self.min_first_chunk, int(max_first_chunk))
+        self.max_chunk = min(ELEVENLABS_MAX_CHUNK, max(self.max_first_chunk, int(max_chunk)))
+        self.schedule_length = max(1, int(schedule_length))
+        self.ttfb_headroom = ttfb_headroom
+
+        # bounded windows so long calls do not grow memory
+        self.tts_ttfb: Deque[float] = deque(maxlen=window)
+        self.llm_ttft: Deque[float] = deque(maxlen=window)
+        self.llm_tokens_per_second: Deque[float] = deque(maxlen=window)
+        self.reply_chars: Deque[int] = deque(maxlen=window)
+
+        self.schedule = list(initial_schedule or FIXED_CHUNK_SCHEDULE)
+
+    @classmethod
+    def from_config(cls, adaptive_config: Dict[str, Any], initial_schedule: Optional[List[int]] = None):
+        options = {k: v for k, v in adaptive_config.items() if k != "enabled"}
+        return cls(initial_schedule=initial_schedule, **options)
+
+    def observe_tts(self, ttfb: float) -> None:
+        if ttfb > 0:
+            self.tts_ttfb.append(ttfb)
+
+    def observe_llm(self, ttft: float, tokens_per_second: float, completion_tokens: int) -> None:
+        if ttft > 0:
+            self.llm_ttft.append(ttft)
+        if tokens_per_second > 0:
+            self.llm_tokens_per_second.append(tokens_per_second)
+        if completion_tokens > 0:
+            self.reply_chars.append(int(completion_tokens * CHARS_PER_TOKEN))
+
+    def compute_schedule(self) -> List[int]:
+        """Derives a schedule from the samples observed so far."""
+        if not self.tts_ttfb or not self.llm_tokens_per_second:
+            return list(self.schedule)
+
+        ttfb = percentile(self.tts_ttfb, 0.9) * self.ttfb_headroom
+        char_rate = max(percentile(self.llm_tokens_per_second, 0.5) * CHARS_PER_TOKEN, 1.0)
+
+        # playback of the first chunk must cover receiving the next chunk's text
+        # and waiting for its first byte of audio
+        first = SPEECH_CHARS_PER_SECOND * (ELEVENLABS_MIN_CHUNK / char_rate + ttfb)
+
+        # on short replies a large first chunk only fires on the final flush,
+        # so keep it below half of a typical reply
+        if self.reply_chars:
+            first = min(first, percentile(self.reply_chars, 0.5) / 2)
+
+        first = int(min(self.max_first_chunk, max(self.min_first_chunk, first)))
+        schedule = [first]
+        while len(schedule) < self.schedule_length:
+            previous = schedule[-1]
+            playback_time = previous / SPEECH_CHARS_PER_SECOND
+            # text that can arrive (and be synthesized) while the previous chunk plays
+            affordable = char_rate * max(playback_time - ttfb, 0.0)
+            schedule.append(int(min(self.max_chunk, max(previous, affordable))))
+        return schedule
+
+    def apply(self, tts) -> bool:
+        """Recomputes the schedule and pushes it to the TTS instance if it changed."""
+        schedule = self.compute_schedule()
+        if schedule == self.schedule:
+            return False
+        opts = getattr(tts, "_opts", None)
+        if opts is None or not hasattr(opts, "chunk_length_schedule"):
+            logger.warning(f"TTS {type(tts).__name__} does not support chunk_length_schedule, adaptive chunking disabled")
+            return False
+        # ElevenLabs reads the schedule when each synthesis stream opens, so the
+        # change applies from the next agent reply onwards
+        opts.chunk_length_schedule = schedule
+        logger.info(f"TTS chunk_length_schedule changed from {self.schedule} to {schedule}")
+        self.schedule = schedule
+        return True
+
+
+def simulate_playback(
+    schedule: List[int],
+    llm_ttft: float,
+    tokens_per_second: float,
+    tts_ttfb: float,
+    reply_chars: int,
+) -> Tuple[float, float, int, int]:
+    """Simulates one agent reply.
+
+    Returns (time to first audio, total stall, stall count, chunk count); every
+    chunk boundary is a possible prosody break, so fewer chunks sound smoother.
+
+    Text streams in at the LLM token rate, a chunk is sent for synthesis when
+    the schedule threshold is reached (or the reply ends), and each chunk's
+    audio is ready one TTS TTFB later.
+    """
+    char_rate = tokens_per_second * CHARS_PER_TOKEN
+    chunks = []
+    sent = 0
+    index = 0
+    while sent < reply_chars:
+        size = schedule[min(index, len(schedule) - 1)]
+        size = min(size, reply_chars - sent)
+        sent += size
+        chunks.append((size, llm_ttft + sent / char_rate))
+        index += 1
+
+    first_audio = 0.0
+    playback_end = 0.0
+    previous_ready = 0.0
+    stall_total = 0.0
+    stall_count = 0
+    for i, (size, text_ready) in enumerate(chunks):
+        ready = max(text_ready + tts_ttfb, previous_ready)
+        previous_ready = ready
+        if i == 0:
+            first_audio = ready
+            playback_end = ready
+        elif ready > playback_end:
+            stall_total += ready - playback_end
+            stall_count += 1
+            playback_end = ready
+        playback_end += size / SPEECH_CHARS_PER_SECOND
+    return first_audio, stall_total, stall_count, len(chunks)
+
+
+SIMULATION_SCENARIOS = {
+    # name: (llm_ttft, tokens_per_second, tts_ttfb, reply_chars)
+    "fast network": (0.35, 90.0, 0.18, 320),
+    "slow network": (0.6, 60.0, 0.55, 320),
+    "slow llm": (0.9, 18.0, 0.25, 320),
+    "short replies": (0.35, 80.0, 0.2, 70),
+    "long replies": (0.4, 70.0, 0.3, 900),
+    "throttled llm": (1.2, 3.0, 0.4, 320),
+}
+
+
+def run_simulation(turns: int = 10) -> None:
+    """Compares the fixed schedule with the adaptive one for each scenario.
+
+    Expect identical or later first audio for the adaptive mode; the gains show
+    up in the stall and chunk columns.
+    """
+    print(f"{'scenario':<16}{'mode':<10}{'schedule':<24}{'first audio':>12}{'stall':>8}{'stalls':>8}{'chunks':>8}")
+    for name, (ttft, tps, ttfb, reply_chars) in SIMULATION_SCENARIOS.items():
+        scheduler = AdaptiveChunkScheduler()
+        for _ in range(turns):
+            scheduler.observe_llm(ttft, tps, int(reply_chars / CHARS_PER_TOKEN))
+            scheduler.observe_tts(ttfb)
+        for mode, schedule in (("fixed", FIXED_CHUNK_SCHEDULE), ("adaptive", scheduler.compute_schedule())):
+            first_audio, stall, stalls, chunks = simulate_playback(schedule, ttft, tps, ttfb, reply_chars)
+            print(f"{name:<16}{mode:<10}{str(schedule):<24}{first_audio:>11.3f}s{stall:>7.3f}s{stalls:>8}{chunks:>8}")
+
+
+if __name__ == "__main__":
+    run_simulation()
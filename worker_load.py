@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import psutil
+
+from metrics_utils import percentile
+
+logger = logging.getLogger("my-worker")
+
+# Admission settings, all overridable from the environment
+LOAD_THRESHOLD = float(os.getenv("WORKER_LOAD_THRESHOLD", "0.75"))
+# 0 means no cap on concurrent sessions besides the load threshold
+MAX_CONCURRENT_SESSIONS = int(os.getenv("MAX_CONCURRENT_SESSIONS", "0"))
+# p95 turn processing delay / event-loop lag at which the worker counts as fully loaded
+PROCESSING_P95_BUDGET = float(os.getenv("TURN_PROCESSING_P95_BUDGET", "1.5"))
+LOOP_LAG_BUDGET = float(os.getenv("LOOP_LAG_BUDGET", "0.2"))
+# touch this file to drain the worker during a rolling deploy, remove it to resume
+DRAIN_FILE = os.getenv("WORKER_DRAIN_FILE", os.path.join(tempfile.gettempdir(), "lk-worker.drain"))
+
+# job processes report their stats here for the worker process to aggregate
+STATS_DIR_ENV = "WORKER_STATS_DIR"
+STATS_REPORT_INTERVAL = 2.0
+STATS_STALE_AFTER = 10.0
+# an accepted job that never shows up in worker.active_jobs stops counting after this
+ACCEPT_PENDING_TIMEOUT = 10.0
+
+_cpu_primed = False
+_last_snapshot: Dict[str, Any] = {"load": 0.0, "draining": False, "active_sessions": 0, "running_jobs": 0}
+# jobs accepted by request_fnc that load_fnc has not seen in worker.active_jobs yet;
+# livekit runs load_fnc in a thread pool, so every access goes through the lock
+_pending_accepts: Dict[str, float] = {}
+_pending_lock = threading.Lock()
+
+
+def stats_dir() -> str:
+    """Shared directory for job stats; set once in the worker process and inherited by jobs."""
+    path = os.getenv(STATS_DIR_ENV)
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), f"lk-worker-stats-{os.getpid()}")
+        os.environ[STATS_DIR_ENV] = path
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_draining() -> bool:
+    return os.path.exists(DRAIN_FILE)
+
+
+def read_job_stats(directory: Optional[str] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Returns the recent stats reported by job processes, ignoring stale files."""
+    directory = directory or stats_dir()
+    now = time.time() if now is None else now
+    reports = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            # file being replaced or removed by a finishing job
+            continue
+        if now - report.get("updated_at", 0) <= STATS_STALE_AFTER:
+            reports.append(report)
+    return reports
+
+
+def compute_load(
+    cpu_percent: float,
+    active_sessions: int,
+    job_reports: List[Dict[str, Any]],
+    max_sessions: int = MAX_CONCURRENT_SESSIONS,
+    draining: bool = False,
+) -> Dict[str, Any]:
+    """Combines the load signals into a single 0..1 value.
+
+    Each signal is normalized against its budget and the worst one wins, so the
+    worker reports full as soon as any resource nears saturation.
+    """
+    processing_delays = [d for report in job_reports for d in report.get("processing_delays", [])]
+    loop_lag = max((report.get("loop_lag_p95", 0.0) for report in job_reports), default=0.0)
+    processing_p95 = percentile(processing_delays, 0.95)
+
+    components = {
+        "cpu": cpu_percent / 100,
+        "sessions": active_sessions / max_sessions if max_sessions > 0 else 0.0,
+        "loop_lag": loop_lag / LOOP_LAG_BUDGET,
+        "processing_p95": processing_p95 / PROCESSING_P95_BUDGET,
+    }
+    load = 1.0 if draining else min(1.0, max(components.values()))
+    return {
+        "load": load,
+        "draining": draining,
+        "active_sessions": active_sessions,
+        "processing_p95": processing_p95,
+        "loop_lag_p95": loop_lag,
+        "components": {k: round(v, 3) for k, v in components.items()},
+    }
+
+
+def load_fnc(worker) -> float:
+    """WorkerOptions.load_fnc combining CPU, sessions, event-loop lag and p95 turn processing delay."""
+    global _cpu_primed, _last_snapshot
+    if not _cpu_primed:
+        # the first call only primes psutil's counter and always returns 0
+        psutil.cpu_percent(interval=None)
+        _cpu_primed = True
+
+    # accepted jobs that are now running are counted through active_jobs instead
+    active_ids = {job.job.id for job in worker.active_jobs}
+    now = time.monotonic()
+    with _pending_lock:
+        for job_id, accepted_at in list(_pending_accepts.items()):
+            if job_id in active_ids or now - accepted_at > ACCEPT_PENDING_TIMEOUT:
+                del _pending_accepts[job_id]
+        pending = len(_pending_accepts)
+
+    draining = is_draining()
+    snapshot = compute_load(
+        cpu_percent=psutil.cpu_percent(interval=None),
+        active_sessions=len(active_ids) + pending,
+        job_reports=read_job_stats(),
+        draining=draining,
+    )
+    snapshot["running_jobs"] = len(active_ids)
+    if snapshot["draining"] != _last_snapshot["draining"]:
+        if draining:
+            logger.info(f"Drain file {DRAIN_FILE} found, refusing new sessions ({snapshot['active_sessions']} active)")
+        else:
+            logger.info("Drain file removed, accepting new sessions")
+    _last_snapshot = snapshot
+    return snapshot["load"]
+
+
+async def request_fnc(req) -> None:
+    """Rejects jobs between load updates once the worker is draining, full or at the session cap.
+
+    The session count is the running jobs from the last load_fnc snapshot plus the
+    jobs accepted since, so a burst of dispatches between two load updates cannot
+    exceed the cap.
+    """
+    snapshot = _last_snapshot
+    if snapshot["draining"] or is_draining():
+        logger.info(f"Rejecting job {req.id}: worker is draining")
+        await req.reject()
+        return
+    if snapshot["load"] >= LOAD_THRESHOLD:
+        logger.info(f"Rejecting job {req.id}: load {snapshot['load']:.2f} {snapshot.get('components')}")
+        await req.reject()
+        return
+    with _pending_lock:
+        active_sessions = snapshot["running_jobs"] + sum(1 for job_id in _pending_accepts if job_id != req.id)
+        at_cap = MAX_CONCURRENT_SESSIONS > 0 and active_sessions >= MAX_CONCURRENT_SESSIONS
+        if not at_cap:
+            # counted before the await so concurrent requests see it
+            _pending_accepts[req.id] = time.monotonic()
+    if at_cap:
+        logger.info(f"Rejecting job {req.id}: {active_sessions} sessions active")
+        await req.reject()
+        return
+    try:
+        await req.accept()
+    except Exception:
+        with _pending_lock:
+            _pending_accepts.pop(req.id, None)
+        raise
+
+
+class JobStatsReporter:
+    """Runs inside a job and publishes its event-loop lag and turn processing delays for load_fnc.
+
+    end_of_utterance_delay is not published: it is mostly the endpointing delay
+    the session chose, up to max_endpointing_delay whenever the turn detector
+    expects the caller to go on, so one caller pausing mid-sentence would mark
+    the whole worker as full. transcription_delay plus on_user_turn_completed_delay
+    is the part of the turn the job did not ask to wait for.
+    """
+
+    def __init__(self, job_id: str, window: int = 20) -> None:
+        self.job_id = job_id
+        self.processing_delays: Deque[float] = deque(maxlen=window)
+        self.loop_lags: Deque[float] = deque(maxlen=window)
+        self._path = os.path.join(stats_dir(), f"{job_id}.json")
+        self._task: Optional[asyncio.Task] = None
+
+    def observe_eou(self, transcription_delay: float, on_user_turn_completed_delay: float) -> None:
+        self.processing_delays.append(max(0.0, transcription_delay) + max(0.0, on_user_turn_completed_delay))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="job_stats_reporter")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + STATS_REPORT_INTERVAL
+            await asyncio.sleep(STATS_REPORT_INTERVAL)
+            # how late the loop woke us up is the lag every other callback also sees
+            self.loop_lags.append(max(0.0, loop.time() - expected))
+            self._write()
+
+    def _write(self) -> None:
+        report = {
+            "job_id": self.job_id,
+            "pid": os.getpid(),
+            "updated_at": time.time(),
+            "processing_delays": list(self.processing_delays),
+            "loop_lag_p95": percentile(self.loop_lags, 0.95),
+        }
+        tmp_path = f"{self._path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(report, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            logger.warning(f"Failed to write job stats: {e}")
+
+    async def aclose(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+def simulate_admission(max_sessions: int = 12, turns: int = 20) -> None:
+    """Ramps sessions on a synthetic worker and shows where each policy stops admitting.
+
+    Each session costs ~9% CPU. Every turn waits the endpointing delay the
+    session chose: min_endpointing_delay (0.5s) normally, max_endpointing_delay
+    (6.0s) on the 10% of turns where the turn detector expects the caller to go
+    on. On top of that comes the processing delay (transcription and turn
+    hooks), modelled as base / (1 - utilization) so it degrades as the CPU
+    saturates. The raw end_of_utterance_delay column shows why it cannot be the
+    load signal: the endpointing waits dominate its p95 from the first session.
+    """
+    base_processing = 0.35
+    cpu_per_session = 9.0
+    endpointing_waits = [6.0 if turn % 10 == 9 else 0.5 for turn in range(turns)]
+    stops: Dict[str, Optional[int]] = {"cpu-only": None, "raw eou": None, "combined": None}
+    degraded_at = None
+
+    print(f"{'sessions':>8}{'cpu':>7}{'raw eou':>9}{'proc p95':>10}{'lag p95':>9}{'cpu-only':>10}{'raw eou':>9}{'combined':>10}")
+    for sessions in range(1, max_sessions + 1):
+        cpu = min(99.0, 10.0 + cpu_per_session * sessions)
+        utilization = cpu / 100
+        # spread the per-turn processing delay a little so the percentiles are not flat
+        processing = [base_processing * (0.8 + 0.4 * turn / turns) / max(1 - utilization, 0.01) for turn in range(turns)]
+        raw_eou = [wait + delay for wait, delay in zip(endpointing_waits, processing)]
+        loop_lag = 0.02 / max(1 - utilization, 0.01)
+
+        processing_p95 = percentile(processing, 0.95)
+        loads = {
+            "cpu-only": cpu / 100,
+            # the previous policy, fed the raw end_of_utterance_delay
+            "raw eou": compute_load(cpu, sessions, [{"processing_delays": raw_eou, "loop_lag_p95": loop_lag}], max_sessions=max_sessions)["load"],
+            "combined": compute_load(cpu, sessions, [{"processing_delays": processing, "loop_lag_p95": loop_lag}], max_sessions=max_sessions)["load"],
+        }
+        for policy, load in loads.items():
+            if stops[policy] is None and load >= LOAD_THRESHOLD:
+                stops[policy] = sessions
+        if degraded_at is None and processing_p95 > PROCESSING_P95_BUDGET:
+            degraded_at = sessions
+        print(
+            f"{sessions:>8}{cpu:>6.0f}%{percentile(raw_eou, 0.95):>8.2f}s{processing_p95:>9.2f}s{loop_lag:>8.3f}s"
+            f"{loads['cpu-only']:>10.2f}{loads['raw eou']:>9.2f}{loads['combined']:>10.2f}"
+        )
+
+    print(f"\nTurn processing p95 exceeds the {PROCESSING_P95_BUDGET}s budget at {degraded_at} sessions")
+    for policy, stop in stops.items():
+        print(f"{policy} load reaches {LOAD_THRESHOLD} at {stop} sessions")
+
+
+if __name__ == "__main__":
+    simulate_admission()